@@ -27,10 +27,14 @@
 
 import numpy as np
 import pandas as pd
-import struct
 import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 
-def read_progress(z):
+# Numbers of processed slices at which read_progress prints a message
+PROGRESS_MILESTONES = frozenset({50, 100, 200, 300, 350, 400})
+
+def read_progress(z, file_name=None):
     """Prints a progress message based on the current slice number. Serves as 
     visual indicator of the program's progress during file reading/writing. It 
     prints a message to the console when the number of processed slices reaches
@@ -40,6 +44,9 @@ def read_progress(z):
      ----------
      z : int
          Current no. of slices that have been processed.
+     file_name : str, optional
+         Name of the file being read/written, shown in the message. Useful when
+         several files are written at the same time. Default is None.
     
      Returns
      -------
@@ -47,17 +54,134 @@ def read_progress(z):
          Function only prints to the console.
      """
      
-    if z in [50, 100, 200, 300, 350, 400]:
-        print(f" > Number of slices read: {z}")
+    if z in PROGRESS_MILESTONES:
+        if file_name is None:
+            print(f" > Number of slices read: {z}")
+        else:
+            print(f" > {file_name}: Number of slices read: {z}")
         
 
 
+def format_column(fmt, values):
+    """Formats an array of voxel values as byte strings. Each distinct value is 
+    formatted only once, with Python's %-formatting, and the result is gathered 
+    back to all the voxels. Phantoms have few distinct materials, organs and 
+    densities, so this is much faster than formatting every voxel.
+
+    Parameters
+    ----------
+    fmt : str
+        The %-format of one value (e.g., ' %4d').
+    values : numpy.ndarray
+        An array with the values to format.
+
+    Returns
+    -------
+    numpy.ndarray
+        An array of byte strings, with the same shape as `values`, with the 
+        formatted values.
+    """
+
+    unique_values, inverse = np.unique(values, return_inverse=True)
+    return np.char.mod(fmt, unique_values).astype(np.bytes_)[inverse.reshape(values.shape)]
+
+
+
+def pack_lines(lines):
+    """Packs an array of byte strings into a contiguous buffer of bytes. NumPy 
+    byte strings have a fixed width and shorter strings are padded with null 
+    bytes, which are dropped.
+
+    Parameters
+    ----------
+    lines : numpy.ndarray
+        An array of byte strings, in the order they are to be written.
+
+    Returns
+    -------
+    numpy.ndarray
+        A 1D array of dtype uint8 with the concatenated strings.
+    """
+
+    buffer = np.ascontiguousarray(lines).view(np.uint8)
+    return buffer[buffer != 0]
+
+
+
+def format_voxel_records(arr_density, arr_material, arr_organ):
+    """Formats the density, material and organ ID columns of the ct-den-mat files 
+    for each voxel. These columns are the same in the XY, XZ and YZ files, only 
+    their order changes, so they are formatted once and reused for all files.
+
+    Parameters
+    ----------
+    arr_density : numpy.ndarray
+        A 1D array containing the density values for each voxel.
+    arr_material : numpy.ndarray
+        A 1D array containing the material IDs for each voxel.
+    arr_organ : numpy.ndarray
+        A 1D array containing the organ IDs for each voxel.
+
+    Returns
+    -------
+    numpy.ndarray
+        A 1D array of byte strings with the end of the line of each voxel, 
+        including the newline (e.g., b' 1.05000e+00    3    3\\n').
+    """
+
+    records = np.char.add(format_column(' %7.5e', arr_density), format_column(' %4d', arr_material))
+    return np.char.add(records, format_column(' %4d\n', arr_organ))
+
+
+
+def fill_ct_buffer(slab_records, slab_indices, slab_air=None):
+    """Formats one slab of the outermost loop of a ct-den-mat file into a buffer 
+    of bytes. Every line is built with NumPy string operations from the formatted 
+    voxel indices and voxel records, so no Python code runs per voxel.
+
+    Parameters
+    ----------
+    slab_records : numpy.ndarray
+        A 2D array with the formatted density, material and organ ID of each voxel 
+        of the slab (see `format_voxel_records`), with the middle loop along the 
+        rows and the innermost loop along the columns.
+    slab_indices : list
+        The formatted IX, IY and IZ columns, as 2D arrays of byte strings with 
+        the shape of the slab.
+    slab_air : numpy.ndarray, optional
+        A 2D boolean array with the voxels of the slab whose lines are omitted 
+        (e.g., air). The blank separator lines are always written. Default is None, 
+        i.e. all lines are written.
+
+    Returns
+    -------
+    numpy.ndarray
+        A 1D array of dtype uint8 with the data lines of the slab, including the 
+        blank separator lines.
+    """
+
+    lines = np.char.add(np.char.add(slab_indices[0], slab_indices[1]), slab_indices[2])
+    lines = np.char.add(lines, slab_records)
+
+    if slab_air is not None:
+        lines = np.where(slab_air, b'', lines)
+
+    # Blank separator lines after each row of the innermost loop, and after the slab
+    separators = np.zeros(lines.shape, dtype='S4')
+    separators[:, -1] = b' \n'
+    separators[-1, -1] = b' \n \n'
+    lines = np.char.add(lines, separators)
+
+    return pack_lines(lines)
+
+
+
 def create_vox_file (vox_file, arr_material, arr_density, n_vox_x, n_vox_y, n_vox_z,
                        vox_res_x, vox_res_y, vox_res_z):
     """Creates a .vox voxel phantom file in the format required by the PENELOPE/
     penEasy simulation framework. It first writes a fixed and then appends the 
-    material and density data for each voxel. The voxel data is written 
-    efficiently using NumPy's `savetxt` function.
+    material and density data for each voxel. The voxel data is formatted 
+    efficiently using NumPy string operations and written in a single operation.
 
     Parameters
     ----------
@@ -88,148 +212,38 @@ def create_vox_file (vox_file, arr_material, arr_density, n_vox_x, n_vox_y, n_vo
     
     # Create the phantom.vox file
     print('Creating the VOX file...\n')
-    with open(vox_file, 'w') as f:
-        # VOX file header
-        f.write('[SECTION VOXELS HEADER v.2008-04-13]\n')
-        f.write(f' {n_vox_x:4d}{n_vox_y:4d}{n_vox_z:4d}\n')
-        f.write(f' {vox_res_x:7.5f} {vox_res_y:7.5f} {vox_res_z:7.5f}\n')
-        f.write(' 1\n')
-        f.write(' 2\n')
-        f.write(' 0\n')
-        f.write('[END OF VXH SECTION]\n')
-
-    # Combine arr_meterial and arr_density to use np.savetxt(), more efficient
-    combined_array_mat_den = np.column_stack((arr_material, arr_density))
-    with open('phantom.vox','a') as f1:
-        np.savetxt(f1, combined_array_mat_den, fmt = '%3d %7.4f')
+    # The file is written in binary mode, with a 1 MB buffer, to skip the text encoding of the voxel data
+    with open(vox_file, 'wb', buffering=1 << 20) as f:
+        # VOX file header, written in a single operation
+        header = ('[SECTION VOXELS HEADER v.2008-04-13]\n'
+                  f' {n_vox_x:4d}{n_vox_y:4d}{n_vox_z:4d}\n'
+                  f' {vox_res_x:7.5f} {vox_res_y:7.5f} {vox_res_z:7.5f}\n'
+                  ' 1\n'
+                  ' 2\n'
+                  ' 0\n'
+                  '[END OF VXH SECTION]\n')
+        f.write(header.encode('ascii'))
+
+        # Format the material and density columns with NumPy string operations, which is faster than np.savetxt()
+        # Each distinct value is formatted only once (see format_column).
+        lines = np.char.add(format_column('%3d', arr_material), format_column(' %7.4f\n', arr_density))
+        f.write(pack_lines(lines))
     
     print(f'The {vox_file} file was created.\n')
 
-    def create_ct_den_mat_file(file_name, arr_density, arr_material, arr_organ, n_vox_x, n_vox_y, n_vox_z, 
-                                 len_x, len_y, len_z, order_indices, loop_order):
-        """
-        Writes CT voxel data (density, material, and organ ID) to a file in GNUPLOT 
-        format, which includes a header and array data. The resulting file is 
-        compatible with GNUPLOT scripts available with the PENELOPE/penEasy 
-        framework. The function is optimized for efficiency by building the entire 
-        data section in memory before writing to the file in a single bulk 
-        operation, which is significantly faster than writing line-by-line in
-        nested loops.
-
-        Parameters
-        ----------
-        file_name : str
-            The full path and filename for the output file (e.g., 'ct-den-matXY.dat').
-        arr_density : numpy.ndarray
-            A 1D array containing the density values for each voxel.
-        arr_material : numpy.ndarray
-            A 1D array containing the material IDs for each voxel.
-        arr_organ : numpy.ndarray
-            A 1D array containing the organ IDs for each voxel.
-        n_vox_x : int
-            The number of voxels in the X-dimension.
-        n_vox_y : int
-            The number of voxels in the Y-dimension.
-        n_vox_z : int
-            The number of voxels in the Z-dimension.
-        len_x : float
-            The total length of the phantom in the X-dimension / cm.
-        len_y : float
-            The total length of the phantom in the Y-dimension / cm.
-        len_z : float
-            The total length of the phantom in the Z-dimension /cm.
-        order_indices : callable
-            Lambda function that takes the loop counters and returns the
-            correctly ordered (x, y, z) tuple corresponding to the original flattened 
-            array indexing order. Allows for the same nested loop to be used for 
-            all ct-den-mat files.
-        loop_order : tuple
-            Tuple containing the dimensions, in the correct order, to loop over
-            for generating the file (e.g., (n_vox_z, n_vox_y, n_vox_x) for an XY file).
-
-        Returns
-        -------
-        None
-            The function writes directly to a file.
-        """
-        
-        with open(file_name, 'w') as f:
-            # Write headers of ct-den-mat file
-            f.write('#  CT structure (GNUPLOT format).\n')
-            f.write(f"#  CT enclosure limits:  XL = {0.0:.6e} cm,  XU = {len_x:.6e} cm\n")
-            f.write(f"#                       YL = {0.0:.6e} cm,  YU = {len_y:.6e} cm\n")
-            f.write(f"#                       ZL = {0.0:.6e} cm,  ZU = {len_z:.6e} cm\n")
-            f.write(f"#  Numbers of voxels:    NVX = {n_vox_x}, NVY = {n_vox_y}, NVZ = {n_vox_z}\n")
-            f.write('#\n')
-            f.write('#\n')
-            f.write('#  columns 1 to 3: bin indices IX, IY and IZ\n')
-            f.write('#  4th column: density (g/cm**3).\n')
-            f.write('#  5th column: material. 6th column: organ ID\n')
-            f.write('#  CT structure (GNUPLOT format).\n')
-
-            # Write lines of ct-den-mat files in nested loops to "lines" list
-            # Loop order is the list that allows for the same nested loop to be used for all ct-den-mat files
-            lines = []
-            for i_loop in range(loop_order[0]):
-                for j_loop in range(loop_order[1]):
-                    for k_loop in range(loop_order[2]):
-                        # Calculate counter, order_indices lambda function is what gives us usual (x, y, z) iteration
-                        # in order to access/perform calculations on arr_density and other arrays
-                        x, y, z = order_indices(i_loop, j_loop, k_loop)
-                        counter = x + n_vox_x * (y + n_vox_y * z)
-
-                        lines.append(f" {x+1:3d} {y+1:3d} {z+1:3d} {arr_density[counter]:7.5e} {arr_material[counter]:4d} {arr_organ[counter]:4d}\n")
-                    
-                    lines.append(' \n')
-                
-                lines.append(' \n')
-
-                read_progress(i_loop)
-            
-            # Write all lines at once. 
-            f.writelines(lines)
-        
-        print(f"\nFile {file_name} created.\n")
-        
-        print("--- FILE VERIFICATION CT-DEN-MAT ---")
-        print("\n--- First 10 lines of the ct-den-mat file: ---\n")
-        with open(file_name, 'r') as f:
-            for i in range(20):  # 7 header lines + 10 data lines
-                print(f.readline().strip())
-                
-        print("\n--- First 10 data lines that do not have two zeros: ---\n")
-        with open(file_name, 'r') as f:
-            # Skip the 7 header lines
-            for _ in range(10):
-                next(f)
-            # Read and process data lines, skipping the zero-value ones
-            count = 0
-            for line in f:
-                # Split the line into material and density values
-                values = line.strip().split()
-                if not values:
-                    continue
-                density = int(values[3])
-                material = float(values[4])
-                # Check if both values are not zero.
-                if material != 0 or density != 0.0:
-                    print(line.strip())
-                    count += 1
-                    if count >= 10:
-                        break
-
 
 
 def create_ct_den_mat_file(file_name, arr_density, arr_material, arr_organ, n_vox_x, n_vox_y, n_vox_z, 
-                         len_x, len_y, len_z, order_indices, loop_order):
+                         len_x, len_y, len_z, axis_order, skip_air=False, voxel_records=None):
     """
     Writes CT voxel data (density, material, and organ ID) to a file in GNUPLOT 
     format, which includes a header and array data. The resulting file is 
     compatible with GNUPLOT scripts available with the PENELOPE/penEasy 
-    framework. The function is optimized for efficiency by building the entire 
-    data section in memory before writing to the file in a single bulk 
-    operation, which is significantly faster than writing line-by-line in
-    nested loops.
+    framework. The function is optimized for efficiency by formatting each slab 
+    of the data section with NumPy string operations (see `fill_ct_buffer`) and 
+    writing it to the file in a single operation, instead of formatting the lines 
+    one by one in nested Python loops. The voxel data can be formatted once, with 
+    `format_voxel_records`, and shared by the XY, XZ and YZ files.
     
     Parameters
     ----------
@@ -240,7 +254,8 @@ def create_ct_den_mat_file(file_name, arr_density, arr_material, arr_organ, n_vo
     arr_material : numpy.ndarray
         A 1D array containing the material IDs for each voxel.
     arr_organ : numpy.ndarray
-        A 1D array containing the organ IDs for each voxel.
+        A 1D array containing the organ IDs for each voxel. Only used if
+        voxel_records is None.
     n_vox_x : int
         The number of voxels in the X-dimension.
     n_vox_y : int
@@ -253,14 +268,19 @@ def create_ct_den_mat_file(file_name, arr_density, arr_material, arr_organ, n_vo
         The total length of the phantom in the Y-dimension / cm.
     len_z : float
         The total length of the phantom in the Z-dimension /cm.
-    order_indices : callable
-        Lambda function that takes the loop counters and returns the
-        correctly ordered (x, y, z) tuple corresponding to the original flattened 
-        array indexing order. Allows for the same nested loop to be used for 
-        all ct-den-mat files.
-    loop_order : tuple
-        Tuple containing the dimensions, in the correct order, to loop over
-        for generating the file (e.g., (n_vox_z, n_vox_y, n_vox_x) for an XY file).
+    axis_order : tuple
+        Tuple containing the axes (0 for x, 1 for y, 2 for z), from the outermost 
+        to the innermost, to loop over for generating the file (e.g., (2, 1, 0) 
+        for an XY file). Allows for the same code to be used for all ct-den-mat files.
+    skip_air : bool, optional
+        If True, the lines of voxels with material 0 and density 0 (air) are not 
+        written, which makes the file much smaller for typical phantoms. The blank 
+        separator lines are still written, but the file no longer holds the full 
+        grid of voxels expected by GNUPLOT's map plots. Default is False.
+    voxel_records : numpy.ndarray, optional
+        The formatted density, material and organ ID of each voxel, as returned 
+        by `format_voxel_records`. Default is None, i.e. they are formatted from 
+        arr_density, arr_material and arr_organ.
     
     Returns
     -------
@@ -268,41 +288,53 @@ def create_ct_den_mat_file(file_name, arr_density, arr_material, arr_organ, n_vo
         The function writes directly to a file.
     """
     
-    with open(file_name, 'w') as f:
-        # Write headers of ct-den-mat file
-        f.write('#  CT structure (GNUPLOT format).\n')
-        f.write(f"#  CT enclosure limits:  XL = {0.0:.6e} cm,  XU = {len_x:.6e} cm\n")
-        f.write(f"#                       YL = {0.0:.6e} cm,  YU = {len_y:.6e} cm\n")
-        f.write(f"#                       ZL = {0.0:.6e} cm,  ZU = {len_z:.6e} cm\n")
-        f.write(f"#  Numbers of voxels:    NVX = {n_vox_x}, NVY = {n_vox_y}, NVZ = {n_vox_z}\n")
-        f.write('#\n')
-        f.write('#\n')
-        f.write('#  columns 1 to 3: bin indices IX, IY and IZ\n')
-        f.write('#  4th column: density (g/cm**3).\n')
-        f.write('#  5th column: material. 6th column: organ ID\n')
-        f.write('#  CT structure (GNUPLOT format).\n')
-    
-        # Write lines of ct-den-mat files in nested loops to "lines" list
-        # Loop order is the list that allows for the same nested loop to be used for all ct-den-mat files
-        lines = []
+    # The file is written in binary mode, with a 1 MB buffer, to skip the text encoding of the voxel data
+    with open(file_name, 'wb', buffering=1 << 20) as f:
+        # Write headers of ct-den-mat file, in a single operation
+        header = ('#  CT structure (GNUPLOT format).\n'
+                  f"#  CT enclosure limits:  XL = {0.0:.6e} cm,  XU = {len_x:.6e} cm\n"
+                  f"#                       YL = {0.0:.6e} cm,  YU = {len_y:.6e} cm\n"
+                  f"#                       ZL = {0.0:.6e} cm,  ZU = {len_z:.6e} cm\n"
+                  f"#  Numbers of voxels:    NVX = {n_vox_x}, NVY = {n_vox_y}, NVZ = {n_vox_z}\n"
+                  '#\n'
+                  '#\n'
+                  '#  columns 1 to 3: bin indices IX, IY and IZ\n'
+                  '#  4th column: density (g/cm**3).\n'
+                  '#  5th column: material. 6th column: organ ID\n'
+                  '#  CT structure (GNUPLOT format).\n')
+        f.write(header.encode('ascii'))
+    
+        # Number of voxels along each loop, from the outermost to the innermost
+        n_vox = (n_vox_x, n_vox_y, n_vox_z)
+        loop_order = tuple(n_vox[axis] for axis in axis_order)
+
+        if voxel_records is None:
+            voxel_records = format_voxel_records(arr_density, arr_material, arr_organ)
+
+        # Permute the voxel records once to the loop order, so that they are read as a linear scan instead of 
+        # being gathered voxel by voxel. The arrays are flattened in (z, y, x) order, i.e. axis 0 (x) is the 
+        # last array dimension, hence the 2 - axis. The XY file follows the storage order and needs no copy.
+        perm = tuple(2 - axis for axis in axis_order)
+        records = np.ascontiguousarray(voxel_records.reshape(n_vox_z, n_vox_y, n_vox_x).transpose(perm))
+        if skip_air:
+            arr_air = (arr_material == 0) & (arr_density == 0)
+            arr_air = np.ascontiguousarray(arr_air.reshape(n_vox_z, n_vox_y, n_vox_x).transpose(perm))
+
+        # Index columns, formatted once for each index along the respective axis and broadcast to the loop order
+        index_columns = []
+        for axis in range(3):
+            shape = [1, 1, 1]
+            shape[axis_order.index(axis)] = n_vox[axis]
+            indices = np.char.mod(' %3d', np.arange(1, n_vox[axis] + 1)).astype(np.bytes_)
+            index_columns.append(np.broadcast_to(indices.reshape(shape), loop_order))
+
+        # Format and write one slab of the outermost loop at a time, so that only the lines of one slab are held in memory
         for i_loop in range(loop_order[0]):
-            for j_loop in range(loop_order[1]):
-                for k_loop in range(loop_order[2]):
-                    # Calculate counter, order_indices lambda function is what gives us usual (x, y, z) iteration
-                    # in order to access/perform calculations on arr_density and other arrays
-                    x, y, z = order_indices(i_loop, j_loop, k_loop)
-                    counter = x + n_vox_x * (y + n_vox_y * z)
-    
-                    lines.append(f" {x+1:3d} {y+1:3d} {z+1:3d} {arr_density[counter]:7.5e} {arr_material[counter]:4d} {arr_organ[counter]:4d}\n")
-                
-                lines.append(' \n')
-            
-            lines.append(' \n')
-    
-            read_progress(i_loop)
-        
-        # Write all lines at once. 
-        f.writelines(lines)
+            out_bytes = fill_ct_buffer(records[i_loop], [column[i_loop] for column in index_columns],
+                                       arr_air[i_loop] if skip_air else None)
+            f.write(out_bytes)
+
+            read_progress(i_loop, file_name)
     
     print(f"\nFile {file_name} created.\n")
     
@@ -335,6 +367,118 @@ def create_ct_den_mat_file(file_name, arr_density, arr_material, arr_organ, n_vo
 
 
 
+def share_array(arr):
+    """Copies an array to a new block of shared memory, so that it can be used by 
+    other processes without being pickled and copied to each of them.
+
+    Parameters
+    ----------
+    arr : numpy.ndarray
+        The array to share.
+
+    Returns
+    -------
+    tuple
+        The shared memory block, which must be closed and unlinked by the caller 
+        once the other processes are done, and the (name, shape, dtype) tuple 
+        used by `create_ct_den_mat_file_shared` to attach to the array.
+    """
+
+    block = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+    np.ndarray(arr.shape, dtype=arr.dtype, buffer=block.buf)[...] = arr
+    return block, (block.name, arr.shape, arr.dtype.str)
+
+
+
+def create_ct_den_mat_file_shared(file_name, shared_arrays, n_vox_x, n_vox_y, n_vox_z, 
+                                  len_x, len_y, len_z, axis_order, skip_air=False):
+    """Creates a ct-den-mat file from voxel data in shared memory (see 
+    `share_array`). Runs in a worker process, so that the XY, XZ and YZ files 
+    can be created in parallel.
+
+    Parameters
+    ----------
+    file_name : str
+        The full path and filename for the output file (e.g., 'ct-den-matXY.dat').
+    shared_arrays : list
+        The (name, shape, dtype) tuples of arr_density, arr_material and of the 
+        voxel records, in this order. The organ IDs are not needed, as they are 
+        already formatted in the voxel records.
+    n_vox_x, n_vox_y, n_vox_z, len_x, len_y, len_z, axis_order, skip_air
+        See `create_ct_den_mat_file`.
+
+    Returns
+    -------
+    None
+        The function writes directly to a file.
+    """
+
+    blocks = [shared_memory.SharedMemory(name=name) for name, _, _ in shared_arrays]
+    try:
+        arrays = [np.ndarray(shape, dtype=dtype, buffer=block.buf)
+                  for block, (_, shape, dtype) in zip(blocks, shared_arrays)]
+        arr_density, arr_material, voxel_records = arrays
+        create_ct_den_mat_file(file_name, arr_density, arr_material, None, n_vox_x, n_vox_y, n_vox_z, 
+                               len_x, len_y, len_z, axis_order, skip_air, voxel_records)
+        # The arrays must be released before the shared memory blocks are closed
+        del arrays, arr_density, arr_material, voxel_records
+    finally:
+        for block in blocks:
+            block.close()
+
+
+
+def apply_organlist(arr_organ, organlist_df, column_headers, material_dtype):
+    """Creates the material ID and density arrays of the phantom from its organ 
+    IDs, in a single step. Look-up tables indexed by organ ID are filled from the 
+    organlist file, negative densities are changed to their absolute value in the 
+    tables, and the tables are then gathered in a single pass over arr_organ.
+
+    Parameters
+    ----------
+    arr_organ : numpy.ndarray
+        A 1D array containing the organ IDs for each voxel.
+    organlist_df : pandas.DataFrame
+        The organlist file, with a row for each organ.
+    column_headers : list
+        The names of the columns of organlist_df with the organ ID, material ID 
+        and density, in this order.
+    material_dtype : numpy.dtype
+        The dtype of the material IDs.
+
+    Returns
+    -------
+    tuple
+        The material ID array, the density array and the maximum organ ID in 
+        arr_organ. Organ IDs that are not in the organlist file get material 0 
+        and density 0. If an organ ID appears more than once in the organlist 
+        file, its last row is used.
+    """
+
+    organ_lut = organlist_df.set_index(column_headers[0])[[column_headers[1], column_headers[2]]]
+    organ_lut = organ_lut[~organ_lut.index.duplicated(keep='last')]
+
+    # The max organ ID of the phantom sizes the look-up tables, and is reported by readPhantom.
+    # Organlist rows outside the tables cannot match any voxel, so they are dropped.
+    max_organ = np.max(arr_organ)
+    organ_lut = organ_lut[(organ_lut.index >= 0) & (organ_lut.index <= max_organ)]
+    organ_ids = organ_lut.index.to_numpy()
+    mat_lut = np.zeros(int(max_organ) + 1, dtype=material_dtype)
+    den_lut = np.zeros(int(max_organ) + 1, dtype=np.float32)
+    mat_lut[organ_ids] = organ_lut[column_headers[1]].to_numpy()
+    den_lut[organ_ids] = organ_lut[column_headers[2]].to_numpy()
+
+    # Check for negative densities, in the LUT before it is applied, so no pass over the voxels is needed
+    if den_lut.min() < 0:
+        print('There are negative densities in the organlist file.\n')
+        print('For the software to function properly, this cannot happen.\n')
+        print('Each density will be chaged to its absolute value.\n\n')
+        np.fabs(den_lut, out=den_lut)
+
+    return np.take(mat_lut, arr_organ), np.take(den_lut, arr_organ), max_organ
+
+
+
 # Main program
 def readPhantom():
     """
@@ -428,9 +572,7 @@ def readPhantom():
         return
      
     
-    # Read the phantom and organlist files into databases
-    print('\nReading the phantom and organlist files...')
-    
+    # Gather all the remaining inputs before the phantom is loaded and processed
     # Load organlist file name
     print("\nWhat is the name of the organlist file?")
     organlist_file = input('> ').strip()
@@ -455,106 +597,141 @@ Warning: Number of column headers provided must be equal to number of columns in
         pass
     
 
-    # Read the organlist file using pandas_fixed width file
-    # The `organlist.dat` file is assumed to be space-separated
+    print('\nIn the organlist file, what are the names of the columns that correspond to the Organ ID, Material ID and Density?\
+These are the same names as provided before. Write the names in order, separated by commas (case sensitive).\
+Default is "Organ_ID","Material_ID", "Density".')
+    column_headers = input('> ').strip().split(',')
+    # Check if the list contains at least one empty string, or if the original input was empty
+    # Split the input
+    column_headers = [header.strip() for header in column_headers]
+    if not column_headers or any(not header for header in column_headers):
+        column_headers = ['Organ_ID', 'Material_ID', 'Density']
+        print(f'The names of the columns are {column_headers}.\n')
+    else:
+        pass
+    
+    print('\nWhat is the name of the .vox phantom file you want to create? (default is "phantom.vox")')
+    vox_file = input('> ').strip()
+    if not vox_file:
+        vox_file='phantom.vox' 
+        print('The name of the .vox phantom file is "phantom.vox" \n')
+    
+    print('\nWhat is the name of the ct-den-matXY, XZ and YZ visualization files you want to create?\
+Write the names in order, separated by commas (case sensitive). (default is "ct-den-matXY.dat", XZ and YZ)')
+    ct_den_mat_files = input('> ').strip().split(',')
+    ct_den_mat_files = [header.strip() for header in ct_den_mat_files]
+    if not ct_den_mat_files or any(not header for header in ct_den_mat_files):
+        ct_den_mat_files=['ct-den-matXY.dat','ct-den-matXZ.dat','ct-den-matYZ.dat']
+        print(f'The name of the ct-den-mat files is {ct_den_mat_files}.\n')
+    elif len(ct_den_mat_files) != 3:
+        raise ValueError(f'Three ct-den-mat file names are needed (XY, XZ and YZ), {len(ct_den_mat_files)} were given.')
+
+    print('\nShould the voxels with material 0 and density 0 (air) be omitted from the ct-den-mat files? (y/n)\
+This makes the files much smaller, but they no longer hold the full voxel grid. Default is n.')
+    # Empty input, or the end of a piped answers file, keeps the default
+    try:
+        skip_air = input('> ').strip().lower() == 'y'
+    except EOFError:
+        skip_air = False
+
+
+    # Read the phantom and organlist files into databases
+    print('\nReading the phantom and organlist files...')
+
+    # Read the organlist file using the C parser of pandas, with the columns separated by any whitespace
+    # The `organlist.dat` file is assumed to be space-separated. If an organ name contains spaces, the fields
+    # shift: the number of columns is wrong, the first field becomes the index or the values land in the wrong
+    # columns. If a name is blank, the fields shift the other way. So the parse is only kept if the organ and
+    # material IDs are integers and the densities are numbers with no gaps. Otherwise the file is read as a
+    # fixed width file instead.
     try:
-        organlist_df = pd.read_fwf(organlist_file, skiprows=organlist_skip_rows,
-                                   names=organlist_df_headers)
+        organlist_df = None
+        try:
+            csv_df = pd.read_csv(organlist_file, sep=r'\s+', skiprows=organlist_skip_rows,
+                                 names=organlist_df_headers, engine='c')
+            if (len(csv_df.columns) == len(organlist_df_headers) and isinstance(csv_df.index, pd.RangeIndex)
+                    and all(header in csv_df.columns for header in column_headers[:3])
+                    and pd.api.types.is_integer_dtype(csv_df[column_headers[0]])
+                    and pd.api.types.is_integer_dtype(csv_df[column_headers[1]])
+                    and pd.api.types.is_numeric_dtype(csv_df[column_headers[2]])
+                    and not csv_df[column_headers[2]].isna().any()):
+                organlist_df = csv_df
+        except (pd.errors.ParserError, ValueError):
+            pass
+        if organlist_df is None:
+            organlist_df = pd.read_fwf(organlist_file, skiprows=organlist_skip_rows,
+                                       names=organlist_df_headers)
     except FileNotFoundError:
         print("Error: Organlist file provided not found or is empty.")
         return
+
+    missing_headers = [header for header in column_headers[:3] if header not in organlist_df.columns]
+    if missing_headers:
+        print(f"Error: Columns {missing_headers} not found in the organlist file. The columns are {list(organlist_df.columns)}.")
+        return
+
     
     
-    # Initialize numpy arrays for marterial_ID, organ_ID and density
-    arr_material = np.zeros(n_vox_tot, dtype=np.int16)
-    arr_density = np.zeros(n_vox_tot, dtype=np.float32)
-    arr_organ = np.zeros(n_vox_tot, dtype=np.int16)
+    # The material IDs are stored in the smallest dtype that holds them and the densities in float32.
+    # The dtype is taken from the material IDs in the organlist file, which can be larger than material_num.
+    # The organ IDs keep the dtype of the phantom file (uint8 for binary, int16 for ASCII).
+    material_ids = organlist_df[column_headers[1]]
+    material_dtype = np.result_type(np.min_scalar_type(material_num), np.min_scalar_type(int(material_ids.max())),
+                                    np.min_scalar_type(int(material_ids.min())))
     
     
     # Read the phantom data based on file type (bin or ASCII)
     print(f"\nLoading {phantom_file}...\n")
 
     if file_type == 0:  # Binary file
-        # Read the entire binary file and interpret it as a stream of single bytes (characters)
-        # Then convert each byte to its ASCII integer value
+        # Map the binary file into memory and interpret it as a stream of single bytes (uint8 organ IDs).
+        # The file is not read into a bytes object first: its pages are loaded on demand by the first pass
+        # over arr_organ. The array is read-only, which is all that is needed.
         try:
-            with open(phantom_file, 'rb') as f:
-                phantom_binary_data = f.read()
-                arr_organ = np.array([struct.unpack('B', byte)[0] for byte in phantom_binary_data], dtype=np.int32)
+            arr_organ = np.memmap(phantom_file, dtype=np.uint8, mode='r')
         except FileNotFoundError:
             print(f"Error: Binary file '{phantom_file}' not found.")
             return
 
     elif file_type == 1:  # ASCII file
         # Cannot use numpy loadtxt because the number of columns(i.e. numbers) per line is inconsistent.
-        # Read all lines as a string, split the string using the spaces
+        # Read all lines as a string and parse it in C with np.fromstring, which treats any whitespace
+        # (spaces and newlines) as separator, without building a list with a string for each voxel.
+        # np.fromstring wraps values that do not fit the dtype, so parse as int32 and narrow after a range check.
         try:
             with open(phantom_file, 'rb') as f:
                 ph_file_str = f.read()
-                arr_organ = np.array(ph_file_str.split(), dtype=np.int16)
+                arr_organ = np.fromstring(ph_file_str, dtype=np.int32, sep=' ')
         except FileNotFoundError:
             print(f"Error: ASCII file '{phantom_file}' not found.")
             return
 
+        int16_info = np.iinfo(np.int16)
+        if arr_organ.size and (arr_organ.min() < int16_info.min or arr_organ.max() > int16_info.max):
+            raise OverflowError(f"Organ IDs in '{phantom_file}' must be between {int16_info.min} and {int16_info.max}.")
+        arr_organ = arr_organ.astype(np.int16)
+
     # Check Data quality, e.g. if the number of voxels read matches the expected total
     if len(arr_organ) != n_vox_tot:
         raise ValueError(f"Number of voxels read ({len(arr_organ)}) does not match expected total ({n_vox_tot}).\
                          Check the phantom characteristics.")
+
+    # Organ IDs index the look-up tables of apply_organlist, where negative IDs would wrap around
+    if np.min(arr_organ) < 0:
+        raise ValueError(f"Negative organ IDs were found in '{phantom_file}'. Organ IDs must be 0 or larger.")
     
-    # Check for negative densities
-    if np.any(arr_density < 0):
-        print('There are negative densities in the organlist file.\n')
-        print('For the software to function properly, this cannot happen.\n')
-        print('Each density will be chaged to its absolute value.\n\n')
-        arr_density = np.abs(arr_density)
-                        
 
     print(f"Finished loading the phantom file. {n_vox_tot} voxels were read.\n")
     
     
-    # Start processing the data for loading to other files
+    # Process the phantom data in one step: organlist look-up, negative density check and max values
     print('Processing the phantom data...\n')
+    arr_material, arr_density, max_organ = apply_organlist(arr_organ, organlist_df, column_headers, material_dtype)
 
-    print('In the organlist file, what are the names of the columns that correspond to the Organ ID, Material ID and Density?\
-These are the same names as provided before. Write the names in order, separated by commas (case sensitive).\
-Default is "Organ_ID","Material_ID", "Density".')
-    column_headers = input('> ').strip().split(',')
-    # Check if the list contains at least one empty string, or if the original input was empty
-    # Split the input
-    column_headers = [header.strip() for header in column_headers]
-    if not column_headers or any(not header for header in column_headers):
-        column_headers = ['Organ_ID', 'Material_ID', 'Density']
-        print(f'The names of the columns are {column_headers}.\n')
-    else:
-        pass
-    
-    print('\nWhat is the name of the .vox phantom file you want to create? (default is "phantom.vox")')
-    vox_file = input('> ').strip()
-    if not vox_file:
-        vox_file='phantom.vox' 
-        print('The name of the .vox phantom file is "phantom.vox" \n')
-    
-    print('\nWhat is the name of the ct-den-matXY, XZ and YZ visualization files you want to create?\
-Write the names in order, separated by commas (case sensitive). (default is "ct-den-matXY.dat", XZ and YZ)')
-    ct_den_mat_files = input('> ').strip().split(',')
-    ct_den_mat_files = [header.strip() for header in ct_den_mat_files]
-    if not ct_den_mat_files or any(not header for header in ct_den_mat_files):
-        ct_den_mat_files=['ct-den-matXY.dat','ct-den-matXZ.dat','ct-den-matYZ.dat']
-        print(f'The name of the ct-den-mat files is {ct_den_mat_files}.\n')
-    else:
-        pass
-    
-    
-    # Create arrays equivalent to arr_organ, arr_material and arr_density, with the material ID and density values
-    for row in organlist_df.itertuples(index=False):
-        organ_indices = np.where(arr_organ == getattr(row, column_headers[0]))
-        arr_material[organ_indices] = getattr(row, column_headers[1])
-        arr_density[organ_indices] = getattr(row, column_headers[2])
-
-    #Calculate and report max values found in phantom file.
+    #Calculate and report max values found in phantom file. The max organ ID was computed for the LUT size.
+    # The LUT maxima cannot replace the array maxima, as the organlist file can have organs absent from the phantom.
     max_material = np.max(arr_material)
     max_density = np.max(arr_density)
-    max_organ = np.max(arr_organ)
 
     print(f'  > Number of materials: {material_num}')
     print(f'  > Maximum value of material ID: {max_material}')
@@ -570,24 +747,38 @@ Write the names in order, separated by commas (case sensitive). (default is "ct-
     
     # Create ct-den-mat.dat files
     print('Creating the ct-den-mat.dat files...\n')
-    
-    # Create ct-den-matXY.dat
-    order_indices_xy = lambda z, y, x: (x, y, z)
-    loop_order_xy = (n_vox_z, n_vox_y, n_vox_x)
-    create_ct_den_mat_file(ct_den_mat_files[0], arr_density, arr_material, arr_organ, n_vox_x, n_vox_y, n_vox_z, 
-                           len_x, len_y, len_z, order_indices_xy, loop_order_xy)
-    
-    # Create ct-den-matXZ.dat
-    order_indices_xz = lambda y, x, z: (x, y, z)
-    loop_order_xz = (n_vox_y, n_vox_x, n_vox_z)
-    create_ct_den_mat_file(ct_den_mat_files[1], arr_density, arr_material, arr_organ, n_vox_x, n_vox_y, n_vox_z, 
-                           len_x, len_y, len_z, order_indices_xz, loop_order_xz)
-    
-    # Create ct-den-matYZ.dat
-    order_indices_yz = lambda x, z, y: (x, y, z)
-    loop_order_yz = (n_vox_x, n_vox_z, n_vox_y)
-    create_ct_den_mat_file(ct_den_mat_files[2], arr_density, arr_material, arr_organ, n_vox_x, n_vox_y, n_vox_z, 
-                           len_x, len_y, len_z, order_indices_yz, loop_order_yz)
+
+    # Format the density, material and organ ID of each voxel once, for the three files
+    voxel_records = format_voxel_records(arr_density, arr_material, arr_organ)
+    
+    # Create ct-den-matXY.dat, ct-den-matXZ.dat and ct-den-matYZ.dat in parallel processes.
+    # The voxel data is placed in shared memory, so that it is not copied to each process.
+    axis_order_xy = (2, 1, 0)
+    axis_order_xz = (1, 0, 2)
+    axis_order_yz = (0, 2, 1)
+    # Each array is released by readPhantom once it is copied, so that the voxel data is not held twice.
+    # The organ IDs are only needed in the voxel records, so they are not shared.
+    voxel_data = [arr_density, arr_material, voxel_records]
+    del arr_density, arr_material, arr_organ, voxel_records
+    shared_blocks, shared_arrays = [], []
+    try:
+        for index in range(len(voxel_data)):
+            block, descriptor = share_array(voxel_data[index])
+            voxel_data[index] = None
+            shared_blocks.append(block)
+            shared_arrays.append(descriptor)
+
+        with ProcessPoolExecutor(max_workers=3) as executor:
+            futures = [executor.submit(create_ct_den_mat_file_shared, file_name, shared_arrays, n_vox_x, n_vox_y, n_vox_z, 
+                                       len_x, len_y, len_z, axis_order, skip_air)
+                       for file_name, axis_order in zip(ct_den_mat_files, (axis_order_xy, axis_order_xz, axis_order_yz))]
+            # Wait for all files, raising any error of the worker processes
+            for future in futures:
+                future.result()
+    finally:
+        for block in shared_blocks:
+            block.close()
+            block.unlink()
 
     print(' All Files for visualization and simulation with this phantom have been created.\n')
 